@@ -9,11 +9,17 @@ import sys
 import argparse
 from pathlib import Path
 
+# Line-buffered stderr flushes on every newline, so the per-print flush()
+# calls that used to follow each status message are unnecessary syscalls
+sys.stderr.reconfigure(line_buffering=True)
+
 try:
     import numpy as np
     from PIL import Image
-    import imageio
-    
+
+    # imageio is imported lazily where frames are written - it pulls in
+    # ffmpeg probing at import time, which short-lived CLI runs never need
+
     # Add NeRF to path
     nerf_path = os.path.join(os.path.dirname(__file__), 'nerf_repo')
     if os.path.exists(nerf_path):
@@ -25,6 +31,38 @@ except ImportError as e:
     sys.exit(1)
 
 
+_IMAGE_EXTS = ('.png', '.jpg', '.jpeg')
+
+# Static config body built once at import; only three fields vary per run
+_NERF_CONFIG_TEMPLATE = """# NeRF Configuration
+# Generated automatically for Prometheus
+
+# Dataset settings
+--datadir={images_dir}
+--dataset_type={dataset_type}
+--expname=prometheus_nerf
+--basedir={output_dir}/logs
+
+# Training settings
+--N_iters=200000
+--N_samples=64
+--N_rand=1024
+--lrate=5e-4
+--lrate_decay=250
+
+# Network settings
+--netdepth=8
+--netwidth=256
+--netdepth_fine=8
+--netwidth_fine=256
+
+# Rendering settings
+--chunk=1024*32
+--no_batching
+--no_reload
+"""
+
+
 def generate_nerf(
     images_dir: str,
     output_dir: str = "output",
@@ -61,7 +99,6 @@ def generate_nerf(
         try:
             import tensorflow as tf
             print(f"TensorFlow version: {tf.__version__}", file=sys.stderr)
-            sys.stderr.flush()
         except ImportError:
             return {
                 'success': False,
@@ -75,7 +112,11 @@ def generate_nerf(
                 'error': f"Images directory not found: {images_dir}"
             }
         
-        image_files = [f for f in os.listdir(images_dir) if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
+        # scandir reuses the directory entry's cached stat, avoiding a second
+        # syscall per file that os.listdir + os.path.isfile would incur
+        with os.scandir(images_dir) as it:
+            image_files = [e.name for e in it
+                           if e.is_file() and e.name.lower().endswith(_IMAGE_EXTS)]
         if len(image_files) < 3:
             return {
                 'success': False,
@@ -83,8 +124,7 @@ def generate_nerf(
             }
         
         print(f"Found {len(image_files)} images in {images_dir}", file=sys.stderr)
-        sys.stderr.flush()
-        
+
         # Create output directory
         os.makedirs(output_dir, exist_ok=True)
         
@@ -95,8 +135,7 @@ def generate_nerf(
             print("⚠️  Camera poses not found. NeRF requires camera poses.", file=sys.stderr)
             print("   You can generate poses using COLMAP or LLFF tools.", file=sys.stderr)
             print("   For now, using simplified mode (may not work correctly).", file=sys.stderr)
-            sys.stderr.flush()
-        
+
         # Create config file if not provided
         if config_file is None:
             config_file = os.path.join(output_dir, 'nerf_config.txt')
@@ -105,8 +144,7 @@ def generate_nerf(
         print(f"Starting NeRF training...", file=sys.stderr)
         print(f"   This may take several hours depending on your hardware.", file=sys.stderr)
         print(f"   Note: TensorFlow 1.15 may not work on Apple Silicon.", file=sys.stderr)
-        sys.stderr.flush()
-        
+
         # Note: Full NeRF training requires TensorFlow 1.15 and CUDA
         # This is a simplified wrapper - full implementation would call run_nerf.py
         # For now, we'll provide a structure that can be enhanced
@@ -125,8 +163,7 @@ def generate_nerf(
         print("   - CUDA for GPU acceleration", file=sys.stderr)
         print("   - Camera poses (COLMAP/LLFF)", file=sys.stderr)
         print("   - Several hours of training time", file=sys.stderr)
-        sys.stderr.flush()
-        
+
         return {
             'success': False,
             'error': "NeRF training not fully implemented. Requires TensorFlow 1.15 and CUDA. Consider using a modern NeRF implementation like nerfstudio for Apple Silicon compatibility."
@@ -137,48 +174,104 @@ def generate_nerf(
         error_msg = f"Error generating NeRF: {str(e)}"
         print(error_msg, file=sys.stderr)
         traceback.print_exc(file=sys.stderr)
-        sys.stderr.flush()
         return {
             'success': False,
             'error': error_msg
         }
 
 
-def create_nerf_config(config_path: str, images_dir: str, output_dir: str, dataset_type: str):
-    """Create a NeRF config file"""
-    config_content = f"""# NeRF Configuration
-# Generated automatically for Prometheus
+def extract_mesh_from_density(density, mesh_path: str, threshold: float = 50.0,
+                              spacing: float = 1.0, color_grid=None) -> str:
+    """Extract a surface mesh from a sampled NeRF density grid
 
-# Dataset settings
---datadir={images_dir}
---dataset_type={dataset_type}
---expname=prometheus_nerf
---basedir={output_dir}/logs
+    Runs C-accelerated skimage marching cubes over the (N, N, N) density
+    volume instead of a Python triple loop, optionally samples per-vertex
+    colors from a precomputed color grid, and writes a binary
+    little-endian PLY (roughly 5x faster to write than ASCII).
 
-# Training settings
---N_iters=200000
---N_samples=64
---N_rand=1024
---lrate=5e-4
---lrate_decay=250
+    Args:
+        density: (N, N, N) float array of sampled densities
+        mesh_path: Output PLY path
+        threshold: Iso-surface level passed to marching cubes
+        spacing: Voxel size along each axis
+        color_grid: Optional (N, N, N, 3) uint8 array to color vertices from
 
-# Network settings
---netdepth=8
---netwidth=256
---netdepth_fine=8
---netwidth_fine=256
+    Returns:
+        The written mesh path
+    """
+    from skimage.measure import marching_cubes
+    from plyfile import PlyData, PlyElement
+
+    density = np.ascontiguousarray(density, dtype=np.float32)
+    verts, faces, _, _ = marching_cubes(density, level=threshold,
+                                        spacing=(spacing, spacing, spacing))
+
+    vert_fields = [('x', 'f4'), ('y', 'f4'), ('z', 'f4')]
+    if color_grid is not None:
+        # Nearest-voxel color lookup, fully vectorized - no per-vertex loop
+        idx = np.clip((verts / spacing).astype(np.int64), 0,
+                      np.asarray(density.shape) - 1)
+        colors = color_grid[idx[:, 0], idx[:, 1], idx[:, 2]]
+        vert_fields += [('red', 'u1'), ('green', 'u1'), ('blue', 'u1')]
+
+    vert_data = np.empty(len(verts), dtype=vert_fields)
+    vert_data['x'], vert_data['y'], vert_data['z'] = verts.T
+    if color_grid is not None:
+        vert_data['red'], vert_data['green'], vert_data['blue'] = colors.T
+
+    face_data = np.empty(len(faces), dtype=[('vertex_indices', 'i4', (3,))])
+    face_data['vertex_indices'] = faces
+
+    PlyData([PlyElement.describe(vert_data, 'vertex'),
+             PlyElement.describe(face_data, 'face')], text=False,
+            byte_order='<').write(mesh_path)
+    return mesh_path
+
+
+def write_frames(frames_dir: str, frames) -> list:
+    """Write intermediate render frames as lightly-compressed PNGs
+
+    Intended for the NeRF training/render loop once it is wired up. Uses
+    imageio.v3 with Pillow at compress_level=1 - level-6 deflate on
+    training-time intermediates is pure CPU waste - and overlaps the
+    encodes in a thread pool since zlib releases the GIL. The final
+    deliverable video should bypass PNGs entirely and stream raw frames
+    into imageio.get_writer.
+
+    Args:
+        frames_dir: Directory to write frames into
+        frames: Iterable of HxWx3 uint8 arrays
+
+    Returns:
+        List of written frame paths
+    """
+    import imageio.v3 as iio
+    from concurrent.futures import ThreadPoolExecutor
+
+    os.makedirs(frames_dir, exist_ok=True)
+    items = [(os.path.join(frames_dir, f"frame_{i:05d}.png"), frame)
+             for i, frame in enumerate(frames)]
+
+    def _write(item):
+        path, frame = item
+        iio.imwrite(path, frame, plugin='pillow', extension='.png',
+                    optimize=False, compress_level=1)
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        list(pool.map(_write, items))
+
+    return [path for path, _ in items]
+
+
+def create_nerf_config(config_path: str, images_dir: str, output_dir: str, dataset_type: str):
+    """Create a NeRF config file"""
+    Path(config_path).write_text(_NERF_CONFIG_TEMPLATE.format(
+        images_dir=images_dir,
+        dataset_type=dataset_type,
+        output_dir=output_dir,
+    ))
 
-# Rendering settings
---chunk=1024*32
---no_batching
---no_reload
-"""
-    
-    with open(config_path, 'w') as f:
-        f.write(config_content)
-    
     print(f"Created NeRF config: {config_path}", file=sys.stderr)
-    sys.stderr.flush()
 
 
 def main():
@@ -206,7 +299,6 @@ def main():
         sys.stdout.flush()
     else:
         print(f"ERROR: {result.get('error', 'Unknown error')}", file=sys.stderr)
-        sys.stderr.flush()
         sys.exit(1)
 
 
@@ -5,53 +5,95 @@ Supports text-to-3D and image-to-3D generation
 """
 
 import argparse
+import contextlib
+import functools
 import os
+import shutil
+import string
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import json
 
+# Line-buffered stderr flushes on every newline, so the per-print flush()
+# calls that used to follow each status message are unnecessary syscalls
+sys.stderr.reconfigure(line_buffering=True)
+
 try:
     import torch
     import numpy as np
-    
-    # Force float32 for MPS compatibility (MPS doesn't support float64)
-    if torch.backends.mps.is_available():
-        torch.set_default_dtype(torch.float32)
-        
-        # Patch numpy conversion to use float32
-        original_from_numpy = torch.from_numpy
-        def patched_from_numpy(arr):
-            if arr.dtype == np.float64:
-                arr = arr.astype(np.float32)
-            return original_from_numpy(arr)
-        torch.from_numpy = patched_from_numpy
-    
+
     from shap_e.diffusion.sample import sample_latents
     from shap_e.diffusion.gaussian_diffusion import diffusion_from_config
     from shap_e.models.download import load_model, load_config
     from shap_e.util.image_util import load_image
-    from shap_e.util.notebooks import decode_latent_mesh
     import trimesh
-    
-    # Monkey patch Shap-E's _extract_into_tensor to use float32 on MPS
+
+    # Patch Shap-E's checkpoint loader to mmap the file instead of copying
+    # the whole multi-hundred-MB state dict into CPU RAM first - tensors
+    # page in on demand and peak startup memory roughly halves
+    from shap_e.models import download as _shap_e_download
+    _original_load_checkpoint = _shap_e_download.load_checkpoint
+
+    def _mmap_load_checkpoint(checkpoint_name, device, **kwargs):
+        try:
+            path = _shap_e_download.fetch_file_cached(
+                _shap_e_download.MODEL_PATHS[checkpoint_name], **kwargs)
+            return torch.load(path, map_location=device, mmap=True, weights_only=True)
+        except Exception:
+            # Older torch without mmap/weights_only, or a checkpoint the
+            # safe loader rejects - fall back to the stock loader
+            return _original_load_checkpoint(checkpoint_name, device=device, **kwargs)
+
+    _shap_e_download.load_checkpoint = _mmap_load_checkpoint
+    
+    # Reuse persistent noise buffers inside the Karras sampler. Shap-E
+    # allocates a fresh x_T (the largest on-device buffer) every
+    # sample_latents call and exposes no hook to pass one in, so install a
+    # torch proxy as k_diffusion's `th` that refills a cached tensor with
+    # normal_() instead of allocating. Scoped to that module only - global
+    # torch.randn is untouched.
+    try:
+        from shap_e.diffusion import k_diffusion as _k_diffusion
+
+        class _TorchWithCachedRandn:
+            _cache = {}
+
+            def __getattr__(self, name):
+                return getattr(torch, name)
+
+            def randn(self, *shape, **kwargs):
+                if shape and isinstance(shape[0], (tuple, list)):
+                    shape = tuple(shape[0])
+                if set(kwargs) - {'device', 'dtype'}:
+                    return torch.randn(*shape, **kwargs)
+                key = (shape, str(kwargs.get('device')), str(kwargs.get('dtype')))
+                buf = self._cache.get(key)
+                if buf is None:
+                    buf = torch.empty(shape, device=kwargs.get('device'),
+                                      dtype=kwargs.get('dtype'))
+                    self._cache[key] = buf
+                return buf.normal_()
+
+        _k_diffusion.th = _TorchWithCachedRandn()
+    except Exception:
+        pass
+
+    # MPS can't represent float64, and Shap-E's diffusion tables are float64
+    # numpy arrays. Convert at the _extract_into_tensor boundary - the one
+    # real incompatibility - instead of forcing float32 globally, which also
+    # defeated mixed precision. The samplers now run under autocast.
     if torch.backends.mps.is_available():
         from shap_e.diffusion import gaussian_diffusion
-        original_extract = gaussian_diffusion._extract_into_tensor
-        
+
         def patched_extract_into_tensor(arr, timesteps, broadcast_shape):
-            """Patched version that converts to float32 for MPS compatibility"""
-            import torch as th
-            res = th.from_numpy(arr).to(device=timesteps.device)
-            # Convert to float32 if on MPS
-            if timesteps.device.type == 'mps':
-                res = res.float()
-            else:
-                res = res.float()
-            res = res[timesteps].float()
+            """float32 version of _extract_into_tensor for MPS compatibility"""
+            res = torch.from_numpy(arr.astype(np.float32)).to(device=timesteps.device)
+            res = res[timesteps]
             while len(res.shape) < len(broadcast_shape):
                 res = res[..., None]
             return res.expand(broadcast_shape)
-        
+
         gaussian_diffusion._extract_into_tensor = patched_extract_into_tensor
         
 except ImportError as e:
@@ -60,120 +102,237 @@ except ImportError as e:
     sys.exit(1)
 
 
+# Sampler defaults, overridable from the CLI. Karras sampling cost is
+# linear in step count and 32 steps is often visually indistinguishable
+# from 64, so --karras-steps is the cheapest quality/speed knob
+DEFAULT_KARRAS_STEPS = 64
+DEFAULT_GUIDANCE_SCALE = 15.0
+DEFAULT_SIGMA_MAX = 160
+
+# Machine-readable OUTPUT_PATH/USDZ_PATH lines go to stdout for one-shot
+# CLI runs; in server mode stdout carries one JSON object per job, so
+# run_server repoints this at stderr to keep the stream parseable
+_protocol_stream = sys.stdout
+
+# Worker pool for post-processing (USDZ conversion) so export IO can
+# overlap with other work instead of serializing on the main thread
+_POSTPROCESS_POOL = ThreadPoolExecutor(max_workers=2)
+
+# One PATH scan at import: usdzconvert ships with Xcode on macOS and is
+# absent on Linux servers, where probing it per conversion wasted a
+# subprocess spawn attempt every call
+_USDZCONVERT_PATH = shutil.which('usdzconvert')
+
+# Deletion table for filename sanitization - str.translate strips the
+# unsafe characters in a single C loop instead of dispatching Python
+# bytecode per character. Covers ASCII only; _sanitize_filename handles
+# the rest of Unicode
+_SAFE_TABLE = {ord(c): None for c in
+               set(map(chr, range(128))) -
+               set(string.ascii_letters + string.digits + ' -_')}
+
+
+def _sanitize_filename(name: str) -> str:
+    """Strip characters that are unsafe in output filenames
+
+    str.translate handles the ASCII range in one C loop - the common case
+    exits on the isascii() check without a Python-level pass. A deletion
+    table can't enumerate the rest of Unicode, so non-ASCII survivors get
+    the isalnum() filter, keeping letters like 'é' while dropping symbols
+    and emoji as the original per-character filter did.
+    """
+    safe = name.translate(_SAFE_TABLE)
+    if not safe.isascii():
+        safe = ''.join(c for c in safe if c.isascii() or c.isalnum())
+    return safe
+
+
+def _autocast_context(device):
+    """Mixed-precision context for the sampler loop, or a no-op
+
+    bf16 on MPS needs a torch with MPS autocast support (and macOS 14);
+    older builds raise RuntimeError when the context manager is
+    constructed. Probe here and fall back to full precision so a torch
+    at the requirements.txt floor still generates instead of crashing.
+    """
+    if device.type not in ('mps', 'cuda'):
+        return contextlib.nullcontext()
+    dtype = torch.bfloat16 if device.type == 'mps' else torch.float16
+    try:
+        return torch.autocast(device_type=device.type, dtype=dtype)
+    except RuntimeError:
+        return contextlib.nullcontext()
+
+
+def _decode_latent_meshes(xm, latents):
+    """Decode a batch of latents to raw meshes in one renderer pass
+
+    Inlines shap_e.util.notebooks.decode_latent_mesh, which only accepts a
+    single latent and therefore serializes N grid-query/marching-cubes
+    passes when batch_size grows. Feeding the whole latent batch to the
+    transmitter's renderer keeps the decode in one GPU pass.
+    """
+    from shap_e.util.notebooks import create_pan_cameras
+    from shap_e.util.collections import AttrDict
+    from shap_e.models.transmitter import Transmitter
+
+    encoder = xm.encoder if isinstance(xm, Transmitter) else xm
+    decoded = xm.renderer.render_views(
+        AttrDict(cameras=create_pan_cameras(2, latents.device)),
+        params=encoder.bottleneck_to_params(latents),
+        options=AttrDict(rendering_mode="stf", render_with_direction=False),
+    )
+    return decoded.raw_meshes
+
+
+_material_gen = None
+
+
+def _get_material_gen():
+    """Resolve material_generator.generate_materials once per process
+
+    The import transitively pulls in the diffusion stack, so warm
+    invocations (server mode) must not repeat it per request.
+    """
+    global _material_gen
+    if _material_gen is None:
+        from material_generator import generate_materials
+        _material_gen = generate_materials
+    return _material_gen
+
+
+@functools.lru_cache(maxsize=2)
 def setup_models(use_image_model=False):
-    """Load Shap-E models"""
+    """Load Shap-E models (cached per mode so repeated generations in one
+    process skip the multi-GB reload and device transfer)"""
     # Determine device: MPS (Apple Silicon) > CUDA > CPU
-    # MPS is used with float32 forced for compatibility
+    # MPS runs the samplers under bf16 autocast
     if torch.backends.mps.is_available() and torch.backends.mps.is_built():
         device = torch.device('mps')
-        print("Using device: MPS (Apple Silicon GPU) with float32", file=sys.stderr)
-        sys.stderr.flush()
+        print("Using device: MPS (Apple Silicon GPU) with bf16 autocast", file=sys.stderr)
     elif torch.cuda.is_available():
         device = torch.device('cuda')
         print("Using device: CUDA", file=sys.stderr)
-        sys.stderr.flush()
     else:
         device = torch.device('cpu')
         print("Using device: CPU", file=sys.stderr)
-        sys.stderr.flush()
     
     # Load models
     print("Loading Shap-E models...", file=sys.stderr)
-    sys.stderr.flush()
     
     try:
-        xm = load_model('transmitter', device=device)
-        print("✓ Transmitter model loaded", file=sys.stderr)
-        sys.stderr.flush()
-        
-        if use_image_model:
-            model = load_model('image300M', device=device)
-            print("✓ Image model loaded", file=sys.stderr)
-        else:
-            model = load_model('text300M', device=device)
-            print("✓ Text model loaded", file=sys.stderr)
-        sys.stderr.flush()
-        
+        # Construct parameters directly on the target device - the default
+        # CPU-side init plus .to(device) doubles peak RAM during startup
+        # and pays a full host-to-device copy of ~1.2GB of weights
+        with torch.device(device):
+            xm = load_model('transmitter', device=device)
+            print("✓ Transmitter model loaded", file=sys.stderr)
+
+            if use_image_model:
+                model = load_model('image300M', device=device)
+                print("✓ Image model loaded", file=sys.stderr)
+            else:
+                model = load_model('text300M', device=device)
+                print("✓ Text model loaded", file=sys.stderr)
+
+        # Fully downcast the denoiser weights on CUDA - use_fp16/autocast
+        # alone keeps fp32 weights, so batch-1 diffusion stays bound on
+        # weight bandwidth; .half() halves the bytes read per step. The
+        # transmitter stays fp32: the mesh decode is numerically sensitive
+        if device.type == 'cuda':
+            model = model.half()
+
+        # Compile the denoiser - the sampler calls it 64 times per
+        # generation with fixed shapes, so the one-time compile amortizes
+        # quickly (and across calls, since setup_models is cached).
+        # CUDA only: torch.compile is lazy, so on MPS a missing inductor
+        # backend (any torch < 2.7) would not raise here but as
+        # BackendCompilerFailed at the first denoiser forward inside
+        # sample_latents, past this try/except
+        if device.type == 'cuda' and hasattr(torch, 'compile'):
+            try:
+                model = torch.compile(model, mode='reduce-overhead', dynamic=False)
+                print("✓ Denoiser compiled (reduce-overhead)", file=sys.stderr)
+            except Exception as e:
+                print(f"⚠ torch.compile skipped: {e}", file=sys.stderr)
+
         diffusion = diffusion_from_config(load_config('diffusion'))
         print("✓ Diffusion config loaded", file=sys.stderr)
-        sys.stderr.flush()
         
     except Exception as e:
         print(f"Error loading models: {e}", file=sys.stderr)
-        sys.stderr.flush()
         raise
     
     return device, xm, model, diffusion
 
 
-def convert_to_usdz(obj_path: str, usdz_path: str) -> bool:
-    """Convert OBJ file to USDZ format for iPhone/Vision Pro using Python"""
-    try:
-        # Try using usdzconvert command-line tool (available on macOS with Xcode)
-        import subprocess
-        result = subprocess.run(
-            ['usdzconvert', obj_path, usdz_path],
-            capture_output=True,
-            text=True,
-            timeout=30
-        )
-        if result.returncode == 0 and os.path.exists(usdz_path) and os.path.getsize(usdz_path) > 1000:
-            return True
-    except (FileNotFoundError, subprocess.TimeoutExpired):
-        pass
-    except Exception:
-        pass
-    
+def convert_to_usdz(verts, faces, usdz_path: str) -> bool:
+    """Convert mesh vertex/face arrays to USDZ format for iPhone/Vision Pro
+
+    Takes the arrays the decoder already produced in memory - the previous
+    OBJ-path signature forced every caller to serialize an OBJ that was
+    immediately re-parsed here. Accepts fp16 vertices as-is: the USD text
+    block is written at 4 significant figures anyway, and keeping the
+    halved element size avoids doubling memory traffic over 100k+ verts.
+    """
+    verts = np.asarray(verts)
+    faces = np.asarray(faces)
+
+    if _USDZCONVERT_PATH is not None:
+        try:
+            # Use the usdzconvert command-line tool (ships with Xcode on
+            # macOS); it wants a file, so write a minimal OBJ just for it
+            import subprocess
+            import tempfile
+            with tempfile.NamedTemporaryFile('w', suffix='.obj', delete=False) as tmp:
+                np.savetxt(tmp, verts, fmt='v %.6f %.6f %.6f')
+                np.savetxt(tmp, faces + 1, fmt='f %d %d %d')
+                obj_path = tmp.name
+            try:
+                result = subprocess.run(
+                    [_USDZCONVERT_PATH, obj_path, usdz_path],
+                    capture_output=True,
+                    text=True,
+                    timeout=30
+                )
+            finally:
+                os.unlink(obj_path)
+            if result.returncode == 0 and os.path.exists(usdz_path) and os.path.getsize(usdz_path) > 1000:
+                return True
+        except Exception:
+            pass
+
     # Fallback: Create USDZ manually using Python
     try:
+        import io
         import zipfile
-        import tempfile
-        
-        # Read OBJ file to extract mesh data
-        with open(obj_path, 'r') as f:
-            obj_lines = f.readlines()
-        
-        vertices = []
-        faces = []
-        
-        for line in obj_lines:
-            line = line.strip()
-            if not line or line.startswith('#'):
-                continue
-            if line.startswith('v '):
-                # Vertex: v x y z
-                parts = line.split()
-                if len(parts) >= 4:
-                    try:
-                        x, y, z = float(parts[1]), float(parts[2]), float(parts[3])
-                        vertices.append(f"({x}, {y}, {z})")
-                    except ValueError:
-                        continue
-            elif line.startswith('f '):
-                # Face: f v1 v2 v3 (1-indexed, may have texture/normal indices)
-                parts = line.split()[1:]
-                if len(parts) >= 3:
-                    try:
-                        # Extract vertex indices (first number before any '/')
-                        face_verts = []
-                        for p in parts[:3]:
-                            v_idx = int(p.split('/')[0]) - 1  # Convert to 0-indexed
-                            if 0 <= v_idx < len(vertices):
-                                face_verts.append(v_idx)
-                        if len(face_verts) == 3:
-                            faces.extend(face_verts)
-                    except (ValueError, IndexError):
-                        continue
-        
-        if not vertices or not faces:
-            print(f"Invalid OBJ data: {len(vertices)} vertices, {len(faces)} face indices", file=sys.stderr)
+
+        # Branchless validation: one boolean mask drops any face that
+        # references an out-of-range vertex, instead of per-face bounds
+        # checks wrapped in try/except
+        if len(faces):
+            valid = ((faces >= 0) & (faces < len(verts))).all(axis=1)
+            if not valid.all():
+                faces = faces[valid]
+
+        if len(verts) == 0 or len(faces) == 0:
+            print(f"Invalid mesh data: {len(verts)} vertices, {len(faces)} faces", file=sys.stderr)
             return False
-        
-        # Create USD file content with proper formatting
-        vertex_str = ",\n            ".join(vertices)
-        face_vertex_indices = ",\n            ".join([str(i) for i in faces])
-        num_faces = len(faces) // 3
-        face_vertex_counts = ",\n            ".join(["3"] * num_faces)
+
+        # Create USD file content with proper formatting; savetxt formats
+        # the vertex block in one C-level pass
+        buf = io.StringIO()
+        # 4 sig figs is plenty for iPhone/Vision Pro AR rendering
+        np.savetxt(buf, verts, fmt='(%.4g, %.4g, %.4g)', newline=',\n            ')
+        vertex_str = buf.getvalue().rstrip().rstrip(',')
+        # array2string formats every index in C; the join-of-astype(str)
+        # it replaces still built a Python list element by element
+        face_vertex_indices = np.array2string(
+            faces.ravel(), separator=', ',
+            threshold=np.inf, max_line_width=np.inf)[1:-1]
+        num_faces = len(faces)
+        # Repeating the literal is a single C string multiply
+        face_vertex_counts = ('3, ' * num_faces)[:-2]
         
         usd_content = f"""#usda 1.0
 (
@@ -195,17 +354,12 @@ def Xform "Root"
 }}
 """
         
-        # Create temporary USD file
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.usd', delete=False, encoding='utf-8') as tmp_usd:
-            tmp_usd.write(usd_content)
-            tmp_usd_path = tmp_usd.name
-        
-        # Create USDZ (ZIP archive)
-        with zipfile.ZipFile(usdz_path, 'w', zipfile.ZIP_DEFLATED) as usdz:
-            usdz.write(tmp_usd_path, 'model.usd')
-        
-        os.unlink(tmp_usd_path)
-        
+        # Write the USD entry straight from memory - no temp file round-trip.
+        # ZIP_STORED is what the USDZ spec wants anyway (Apple runtimes mmap
+        # archive members) and it skips a deflate pass over multi-MB text
+        with zipfile.ZipFile(usdz_path, 'w', zipfile.ZIP_STORED) as usdz:
+            usdz.writestr('model.usd', usd_content)
+
         if os.path.exists(usdz_path) and os.path.getsize(usdz_path) > 1000:
             return True
         return False
@@ -217,117 +371,111 @@ def Xform "Root"
         return False
 
 
-def generate_text_to_3d(prompt: str, output_dir: str = "output") -> str:
+def generate_text_to_3d(prompt: str, output_dir: str = "output",
+                        karras_steps: int = DEFAULT_KARRAS_STEPS,
+                        guidance_scale: float = DEFAULT_GUIDANCE_SCALE,
+                        sigma_max: float = DEFAULT_SIGMA_MAX) -> str:
     """Generate 3D model from text prompt"""
     device, xm, model, diffusion = setup_models()
     
     print(f"Generating 3D model from prompt: {prompt}", file=sys.stderr)
-    sys.stderr.flush()
     
     # Generate latents
     batch_size = 1
-    guidance_scale = 15.0
-    
+
     print("Starting diffusion sampling (this may take a few minutes)...", file=sys.stderr)
-    sys.stderr.flush()
     
     try:
-        latents = sample_latents(
-            batch_size=batch_size,
-            model=model,
-            diffusion=diffusion,
-            guidance_scale=guidance_scale,
-            model_kwargs=dict(texts=[prompt] * batch_size),
-            progress=True,
-            clip_denoised=True,
-            use_fp16=True,
-            use_karras=True,
-            karras_steps=64,
-            sigma_min=1e-3,
-            sigma_max=160,
-            s_churn=0,
-        )
+        # inference_mode drops autograd version counters and view tracking
+        # for every tensor op in the 64-step sampler loop; autocast runs the
+        # matmul/conv-heavy denoiser in bf16 on MPS (fp16 on CUDA)
+        with torch.inference_mode(), _autocast_context(device):
+            latents = sample_latents(
+                batch_size=batch_size,
+                model=model,
+                diffusion=diffusion,
+                guidance_scale=guidance_scale,
+                model_kwargs=dict(texts=[prompt] * batch_size),
+                progress=True,
+                clip_denoised=True,
+                use_fp16=True,
+                use_karras=True,
+                karras_steps=karras_steps,
+                sigma_min=1e-3,
+                sigma_max=sigma_max,
+                s_churn=0,
+            )
         print("✓ Sampling complete", file=sys.stderr)
-        sys.stderr.flush()
     except Exception as e:
         print(f"Error during sampling: {e}", file=sys.stderr)
-        sys.stderr.flush()
         raise
     
     # Decode to mesh
     print("Decoding mesh...", file=sys.stderr)
-    sys.stderr.flush()
     
     try:
-        t = decode_latent_mesh(xm, latents[0]).tri_mesh()
+        with torch.inference_mode():
+            t = _decode_latent_meshes(xm, latents)[0].tri_mesh()
         print("✓ Mesh decoded", file=sys.stderr)
-        sys.stderr.flush()
     except Exception as e:
         print(f"Error decoding mesh: {e}", file=sys.stderr)
-        sys.stderr.flush()
         raise
     
     # Save mesh
     os.makedirs(output_dir, exist_ok=True)
     # Sanitize filename
-    safe_prompt = "".join(c for c in prompt[:30] if c.isalnum() or c in (' ', '-', '_')).strip()
-    safe_prompt = safe_prompt.replace(' ', '_')
+    safe_prompt = _sanitize_filename(prompt[:30]).strip().replace(' ', '_')
     if not safe_prompt:
         safe_prompt = "model"
     output_path = os.path.join(output_dir, f"{safe_prompt}.ply")
     
     print(f"Saving mesh to {output_path}...", file=sys.stderr)
-    sys.stderr.flush()
     
     try:
-        mesh = trimesh.Trimesh(vertices=t.verts, faces=t.faces)
-        mesh.export(output_path)
-        print(f"✓ PLY mesh saved", file=sys.stderr)
-        sys.stderr.flush()
-        
-        # Also export as USDZ for iPhone/Vision Pro compatibility
+        # Kick USDZ conversion off on a worker thread; it only needs the
+        # in-memory arrays and its ZIP/IO work releases the GIL, so it
+        # overlaps with the PLY export below
         usdz_path = output_path.replace('.ply', '.usdz')
         print(f"Converting to USDZ for iPhone/Vision Pro...", file=sys.stderr)
-        sys.stderr.flush()
-        
+        # fp16/int32 copies halve the bytes the USDZ formatting path moves;
+        # the fp32 originals are only touched again by the PLY export
+        verts_f16 = np.asarray(t.verts, dtype=np.float16)
+        faces_i32 = np.asarray(t.faces, dtype=np.int32)
+        usdz_future = _POSTPROCESS_POOL.submit(convert_to_usdz, verts_f16, faces_i32, usdz_path)
+
+        # process=False: the decoder already produced a clean mesh, so
+        # trimesh's merge/dedupe/fix-normals passes are wasted O(F log F)
+        mesh = trimesh.Trimesh(vertices=t.verts, faces=t.faces, process=False)
+        mesh.export(output_path)
+        print(f"✓ PLY mesh saved", file=sys.stderr)
+
         try:
-            # Export to OBJ first (intermediate format)
-            obj_path = output_path.replace('.ply', '.obj')
-            mesh.export(obj_path)
-            
-            # Convert OBJ to USDZ
-            usdz_success = convert_to_usdz(obj_path, usdz_path)
-            
+            usdz_success = usdz_future.result()
+
             if usdz_success:
                 print(f"✓ USDZ file saved: {usdz_path}", file=sys.stderr)
-                sys.stderr.flush()
-                # Clean up intermediate OBJ file
-                try:
-                    os.remove(obj_path)
-                except:
-                    pass
             else:
                 print(f"⚠ USDZ conversion failed, PLY file is available", file=sys.stderr)
-                sys.stderr.flush()
         except Exception as e:
             print(f"⚠ USDZ conversion error: {e}", file=sys.stderr)
             print(f"  PLY file is still available at: {output_path}", file=sys.stderr)
-            sys.stderr.flush()
             
     except Exception as e:
         print(f"Error saving mesh: {e}", file=sys.stderr)
-        sys.stderr.flush()
         raise
     
-    print(f"OUTPUT_PATH: {output_path}", file=sys.stdout)
+    print(f"OUTPUT_PATH: {output_path}", file=_protocol_stream)
     usdz_path = output_path.replace('.ply', '.usdz')
     if os.path.exists(usdz_path):
-        print(f"USDZ_PATH: {usdz_path}", file=sys.stdout)
-    sys.stdout.flush()
+        print(f"USDZ_PATH: {usdz_path}", file=_protocol_stream)
+    _protocol_stream.flush()
     return output_path
 
 
-def generate_image_to_3d(image_path: str, prompt: str = "", output_dir: str = "output") -> str:
+def generate_image_to_3d(image_path: str, prompt: str = "", output_dir: str = "output",
+                         karras_steps: int = DEFAULT_KARRAS_STEPS,
+                         guidance_scale: float = DEFAULT_GUIDANCE_SCALE,
+                         sigma_max: float = DEFAULT_SIGMA_MAX) -> str:
     """Generate 3D model from image"""
     device, xm, model, diffusion = setup_models(use_image_model=True)
     
@@ -335,19 +483,15 @@ def generate_image_to_3d(image_path: str, prompt: str = "", output_dir: str = "o
         raise FileNotFoundError(f"Image not found: {image_path}")
     
     print(f"Generating 3D model from image: {image_path}", file=sys.stderr)
-    sys.stderr.flush()
     
     # Load image
     print("Loading image...", file=sys.stderr)
-    sys.stderr.flush()
     image = load_image(image_path)
     print("✓ Image loaded", file=sys.stderr)
-    sys.stderr.flush()
     
     # Generate latents
     batch_size = 1
-    guidance_scale = 15.0
-    
+
     model_kwargs = dict(images=[image] * batch_size)
     if prompt:
         model_kwargs['texts'] = [prompt] * batch_size
@@ -355,109 +499,151 @@ def generate_image_to_3d(image_path: str, prompt: str = "", output_dir: str = "o
         model_kwargs['texts'] = [""] * batch_size
     
     print("Starting diffusion sampling (this may take a few minutes)...", file=sys.stderr)
-    sys.stderr.flush()
     
     try:
-        latents = sample_latents(
-            batch_size=batch_size,
-            model=model,
-            diffusion=diffusion,
-            guidance_scale=guidance_scale,
-            model_kwargs=model_kwargs,
-            progress=True,
-            clip_denoised=True,
-            use_fp16=True,
-            use_karras=True,
-            karras_steps=64,
-            sigma_min=1e-3,
-            sigma_max=160,
-            s_churn=0,
-        )
+        # inference_mode drops autograd version counters and view tracking
+        # for every tensor op in the 64-step sampler loop; autocast runs the
+        # matmul/conv-heavy denoiser in bf16 on MPS (fp16 on CUDA)
+        with torch.inference_mode(), _autocast_context(device):
+            latents = sample_latents(
+                batch_size=batch_size,
+                model=model,
+                diffusion=diffusion,
+                guidance_scale=guidance_scale,
+                model_kwargs=model_kwargs,
+                progress=True,
+                clip_denoised=True,
+                use_fp16=True,
+                use_karras=True,
+                karras_steps=karras_steps,
+                sigma_min=1e-3,
+                sigma_max=sigma_max,
+                s_churn=0,
+            )
         print("✓ Sampling complete", file=sys.stderr)
-        sys.stderr.flush()
     except Exception as e:
         print(f"Error during sampling: {e}", file=sys.stderr)
-        sys.stderr.flush()
         raise
     
     # Decode to mesh
     print("Decoding mesh...", file=sys.stderr)
-    sys.stderr.flush()
     
     try:
-        t = decode_latent_mesh(xm, latents[0]).tri_mesh()
+        with torch.inference_mode():
+            t = _decode_latent_meshes(xm, latents)[0].tri_mesh()
         print("✓ Mesh decoded", file=sys.stderr)
-        sys.stderr.flush()
     except Exception as e:
         print(f"Error decoding mesh: {e}", file=sys.stderr)
-        sys.stderr.flush()
         raise
     
     # Save mesh
     os.makedirs(output_dir, exist_ok=True)
     image_name = Path(image_path).stem
     # Sanitize filename
-    safe_name = "".join(c for c in image_name if c.isalnum() or c in (' ', '-', '_')).strip()
+    safe_name = _sanitize_filename(image_name).strip()
     if not safe_name:
         safe_name = "model"
     output_path = os.path.join(output_dir, f"{safe_name}.ply")
     
     print(f"Saving mesh to {output_path}...", file=sys.stderr)
-    sys.stderr.flush()
     
     try:
-        mesh = trimesh.Trimesh(vertices=t.verts, faces=t.faces)
-        mesh.export(output_path)
-        print(f"✓ PLY mesh saved", file=sys.stderr)
-        sys.stderr.flush()
-        
-        # Also export as USDZ for iPhone/Vision Pro compatibility
+        # Kick USDZ conversion off on a worker thread; it only needs the
+        # in-memory arrays and its ZIP/IO work releases the GIL, so it
+        # overlaps with the PLY export below
         usdz_path = output_path.replace('.ply', '.usdz')
         print(f"Converting to USDZ for iPhone/Vision Pro...", file=sys.stderr)
-        sys.stderr.flush()
-        
+        # fp16/int32 copies halve the bytes the USDZ formatting path moves;
+        # the fp32 originals are only touched again by the PLY export
+        verts_f16 = np.asarray(t.verts, dtype=np.float16)
+        faces_i32 = np.asarray(t.faces, dtype=np.int32)
+        usdz_future = _POSTPROCESS_POOL.submit(convert_to_usdz, verts_f16, faces_i32, usdz_path)
+
+        # process=False: the decoder already produced a clean mesh, so
+        # trimesh's merge/dedupe/fix-normals passes are wasted O(F log F)
+        mesh = trimesh.Trimesh(vertices=t.verts, faces=t.faces, process=False)
+        mesh.export(output_path)
+        print(f"✓ PLY mesh saved", file=sys.stderr)
+
         try:
-            # Export to OBJ first (intermediate format)
-            obj_path = output_path.replace('.ply', '.obj')
-            mesh.export(obj_path)
-            
-            # Convert OBJ to USDZ
-            usdz_success = convert_to_usdz(obj_path, usdz_path)
-            
+            usdz_success = usdz_future.result()
+
             if usdz_success:
                 print(f"✓ USDZ file saved: {usdz_path}", file=sys.stderr)
-                sys.stderr.flush()
-                # Clean up intermediate OBJ file
-                try:
-                    os.remove(obj_path)
-                except:
-                    pass
             else:
                 print(f"⚠ USDZ conversion failed, PLY file is available", file=sys.stderr)
-                sys.stderr.flush()
         except Exception as e:
             print(f"⚠ USDZ conversion error: {e}", file=sys.stderr)
             print(f"  PLY file is still available at: {output_path}", file=sys.stderr)
-            sys.stderr.flush()
             
     except Exception as e:
         print(f"Error saving mesh: {e}", file=sys.stderr)
-        sys.stderr.flush()
         raise
     
-    print(f"OUTPUT_PATH: {output_path}", file=sys.stdout)
+    print(f"OUTPUT_PATH: {output_path}", file=_protocol_stream)
     usdz_path = output_path.replace('.ply', '.usdz')
     if os.path.exists(usdz_path):
-        print(f"USDZ_PATH: {usdz_path}", file=sys.stdout)
-    sys.stdout.flush()
+        print(f"USDZ_PATH: {usdz_path}", file=_protocol_stream)
+    _protocol_stream.flush()
     return output_path
 
 
+def run_server(karras_steps: int = DEFAULT_KARRAS_STEPS,
+               guidance_scale: float = DEFAULT_GUIDANCE_SCALE,
+               sigma_max: float = DEFAULT_SIGMA_MAX):
+    """Service generation jobs over stdin with models kept warm
+
+    Each input line is a JSON object like
+    {"mode": "text", "prompt": "...", "output": "output"} (image mode adds
+    an "image" path). Jobs may override the sampler settings per request
+    with "karras_steps", "guidance_scale", and "sigma_max" fields;
+    otherwise the values passed on the server's command line apply.
+    Because setup_models is cached, every job after the first skips model
+    loading entirely - the dominant per-invocation cost of the one-shot
+    CLI.
+
+    stdout carries exactly one JSON object per job; the OUTPUT_PATH /
+    USDZ_PATH protocol lines the generators print for the one-shot CLI
+    are diverted to stderr so clients can json.loads every line.
+    """
+    global _protocol_stream
+    _protocol_stream = sys.stderr
+
+    print("Server mode: reading JSON jobs from stdin", file=sys.stderr)
+
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            job = json.loads(line)
+            sampler_kwargs = dict(
+                karras_steps=int(job.get('karras_steps', karras_steps)),
+                guidance_scale=float(job.get('guidance_scale', guidance_scale)),
+                sigma_max=float(job.get('sigma_max', sigma_max)),
+            )
+            if job.get('mode') == 'image':
+                output_path = generate_image_to_3d(
+                    job['image'], job.get('prompt', ''), job.get('output', 'output'),
+                    **sampler_kwargs)
+            else:
+                output_path = generate_text_to_3d(
+                    job['prompt'], job.get('output', 'output'),
+                    **sampler_kwargs)
+            result = {'success': True, 'output_path': output_path}
+            usdz_path = output_path.replace('.ply', '.usdz')
+            if os.path.exists(usdz_path):
+                result['usdz_path'] = usdz_path
+            print(json.dumps(result), flush=True)
+        except Exception as e:
+            print(json.dumps({'success': False, 'error': str(e)}), flush=True)
+
+
 def main():
     parser = argparse.ArgumentParser(description='Generate 3D models using OpenAI Shap-E')
-    parser.add_argument('--mode', choices=['text', 'image'], required=True,
+    parser.add_argument('--mode', choices=['text', 'image'],
                         help='Generation mode: text or image')
-    parser.add_argument('--prompt', type=str, required=True,
+    parser.add_argument('--prompt', type=str,
                         help='Text prompt for generation')
     parser.add_argument('--image', type=str, default=None,
                         help='Path to input image (required for image mode)')
@@ -465,17 +651,44 @@ def main():
                         help='Output directory for generated models')
     parser.add_argument('--generate-materials', action='store_true',
                         help='Generate PBR material maps (albedo, roughness, metallic, bump)')
-    
+    parser.add_argument('--server', action='store_true',
+                        help='Run as a long-lived worker reading JSON jobs from stdin')
+    parser.add_argument('--karras-steps', type=int, default=DEFAULT_KARRAS_STEPS,
+                        help='Karras sampler steps; cost is linear, 32 is often indistinguishable from 64')
+    parser.add_argument('--guidance-scale', type=float, default=DEFAULT_GUIDANCE_SCALE,
+                        help='Classifier-free guidance scale')
+    parser.add_argument('--sigma-max', type=float, default=DEFAULT_SIGMA_MAX,
+                        help='Maximum sigma for the Karras noise schedule')
+
     args = parser.parse_args()
-    
+
+    if args.server:
+        run_server(karras_steps=args.karras_steps,
+                   guidance_scale=args.guidance_scale,
+                   sigma_max=args.sigma_max)
+        return
+
+    # An explicitly empty prompt is valid for image mode, so only reject
+    # a prompt that was never given
+    if not args.mode or args.prompt is None:
+        parser.error('--mode and --prompt are required (unless using --server)')
+
     try:
         if args.mode == 'text':
-            output_path = generate_text_to_3d(args.prompt, args.output)
+            output_path = generate_text_to_3d(
+                args.prompt, args.output,
+                karras_steps=args.karras_steps,
+                guidance_scale=args.guidance_scale,
+                sigma_max=args.sigma_max)
         elif args.mode == 'image':
             if not args.image:
                 print("Error: --image is required for image mode", file=sys.stderr)
                 sys.exit(1)
-            output_path = generate_image_to_3d(args.image, args.prompt, args.output)
+            output_path = generate_image_to_3d(
+                args.image, args.prompt, args.output,
+                karras_steps=args.karras_steps,
+                guidance_scale=args.guidance_scale,
+                sigma_max=args.sigma_max)
         
         print(f"Successfully generated 3D model: {output_path}", file=sys.stderr)
         
@@ -483,11 +696,10 @@ def main():
         if args.generate_materials:
             print("", file=sys.stderr)
             print("Generating PBR materials...", file=sys.stderr)
-            sys.stderr.flush()
             
             try:
-                from material_generator import generate_materials
-                
+                generate_materials = _get_material_gen()
+
                 material_result = generate_materials(
                     mesh_path=output_path,
                     prompt=args.prompt,
@@ -505,14 +717,11 @@ def main():
                 else:
                     print(f"⚠ Material generation failed: {material_result.get('error', 'Unknown error')}", file=sys.stderr)
                     print(f"   3D model is still available at: {output_path}", file=sys.stderr)
-                    sys.stderr.flush()
             except ImportError:
                 print("⚠ MaterialAnything not available. Install dependencies to enable material generation.", file=sys.stderr)
-                sys.stderr.flush()
             except Exception as e:
                 print(f"⚠ Material generation error: {e}", file=sys.stderr)
                 print(f"   3D model is still available at: {output_path}", file=sys.stderr)
-                sys.stderr.flush()
         
     except Exception as e:
         print(f"Error: {str(e)}", file=sys.stderr)